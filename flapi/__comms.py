@@ -6,39 +6,156 @@ Code for communicating events to FL Studio.
 For data model, see Protocol.md in the project root directory.
 """
 import time
+import pickle
 import logging
-from base64 import b64decode, b64encode
-from mido import Message as MidoMsg  # type: ignore
-from typing import Any, Optional
-from .__util import decode_python_object
-from .__context import get_context
+from queue import Empty
+from typing import Any, Callable, Optional, Sequence, Union, TYPE_CHECKING
+from .__util import b64decode, b64encode, decode_python_object, encode_code
+from .__context import get_context, FlapiContext, RequestPrefixes
 from flapi import _consts as consts
 from flapi._consts import MessageOrigin, MessageStatus, MessageType
 from .errors import (
     FlapiTimeoutError,
-    FlapiInvalidMsgError,
     FlapiServerError,
     FlapiClientError,
     FlapiServerExit,
     FlapiClientExit,
 )
+if TYPE_CHECKING:
+    from mido import Message as MidoMsg  # type: ignore
+    from mido.ports import BaseOutput  # type: ignore
 
 
 log = logging.getLogger(__name__)
 
 
-def send_msg(msg: bytes):
+HEADER_LEN = len(consts.SYSEX_HEADER)
+"""
+Length of the Flapi sysex header
+"""
+
+
+CLIENT_HEADER = consts.SYSEX_HEADER + bytes([MessageOrigin.CLIENT])
+"""
+Header for messages sent by the client, including the message origin byte, so
+that it doesn't need to be built for every request
+"""
+
+
+# Status codes as plain ints, since comparing against these is much faster than
+# looking up members of the enum, and the status of every response is checked
+STATUS_OK = int(MessageStatus.OK)
+STATUS_ERR = int(MessageStatus.ERR)
+STATUS_FAIL = int(MessageStatus.FAIL)
+
+
+def make_raw_sender(port: 'BaseOutput') -> Callable[[bytes], None]:
+    """
+    Create a function that sends a complete sysex frame (including the start
+    and end bytes) on the given port.
+
+    If the port uses the rtmidi backend, the frame is given to rtmidi directly,
+    since constructing a Mido message validates every data byte in Python,
+    which is slow for large messages. Otherwise, we fall back to sending a Mido
+    message, skipping its checks since Flapi built the data itself.
+    """
+    rt = getattr(port, "_rt", None)
+    if rt is not None:
+        send_message = rt.send_message
+        # Hold the port's lock like Mido does, since the device enquiry
+        # response is sent from the receiving thread
+        lock = port._lock
+
+        def send_raw_rt(frame: bytes) -> None:
+            with lock:
+                send_message(frame)
+
+        return send_raw_rt
+
+    # Only import this when it's needed, since most ports use rtmidi
+    from mido import Message as MidoMsg  # type: ignore
+
+    def send_raw(frame: bytes) -> None:
+        port.send(MidoMsg("sysex", skip_checks=True, data=frame[1:-1]))
+
+    return send_raw
+
+
+def build_request_prefixes(client_id: int) -> RequestPrefixes:
+    """
+    Build the start of each type of request for the given client ID, for use
+    as `FlapiContext.request_prefixes`.
+    """
+    return RequestPrefixes(
+        (msg_type, CLIENT_HEADER + bytes([client_id, msg_type]))
+        for msg_type in MessageType
+    )
+
+
+def send_msg(msg: bytes, ctx: Optional[FlapiContext] = None):
     """
     Send a message to FL Studio
+
+    Callers that have already looked up the context can pass it, to avoid
+    looking it up again.
     """
-    mido_msg = MidoMsg("sysex", data=msg)
-    get_context().req_port.send(mido_msg)
+    if ctx is None:
+        ctx = get_context()
+    ctx.send_raw(b"".join((b"\xF0", msg, b"\xF7")))
 
 
 def handle_stdout(output: str):
     print(output, end='')
 
 
+def handle_stdout_msg(data: memoryview) -> None:
+    """
+    Handle FL Studio stdout
+    """
+    # Replace invalid characters rather than failing, since this is only
+    # being displayed
+    text = b64decode(data).decode(errors="replace")
+    log.debug("Received server stdout: %s", text)
+    handle_stdout(text)
+
+
+def handle_stdout_raw_msg(data: memoryview) -> None:
+    """
+    Handle FL Studio stdout containing only ASCII text
+    """
+    # Skip the status byte, since the text isn't encoded
+    text = bytes(data[1:]).decode("ascii", errors="replace")
+    log.debug("Received server stdout: %s", text)
+    handle_stdout(text)
+
+
+def handle_client_goodbye_msg(data: memoryview) -> None:
+    """
+    Handle exit command
+    """
+    code = int(b64decode(data).decode())
+    log.info(f"Received exit command with code {code}")
+    raise FlapiClientExit(code)
+
+
+def handle_server_goodbye_msg(data: memoryview) -> None:
+    """
+    Handle server disconnect
+    """
+    raise FlapiServerExit()
+
+
+message_handlers: dict[int, Callable[[memoryview], None]] = {
+    MessageType.STDOUT: handle_stdout_msg,
+    MessageType.STDOUT_RAW: handle_stdout_raw_msg,
+    MessageType.CLIENT_GOODBYE: handle_client_goodbye_msg,
+    MessageType.SERVER_GOODBYE: handle_server_goodbye_msg,
+}
+"""
+Handlers for messages from FL Studio that aren't responses to our requests
+"""
+
+
 def handle_received_message(msg: bytes) -> Optional[bytes]:
     """
     Handling of some received MIDI messages. If the event is a response to an
@@ -52,41 +169,51 @@ def handle_received_message(msg: bytes) -> Optional[bytes]:
         send_msg(consts.DEVICE_ENQUIRY_RESPONSE)
         return None
 
-    # Handle invalid message types
+    # Ignore messages from other devices on the port, rather than failing
+    # whichever request is waiting for a response
     if not msg.startswith(consts.SYSEX_HEADER):
-        log.debug('Received unrecognised message')
-        raise FlapiInvalidMsgError(msg)
+        log.debug('Ignoring unrecognised sysex message: %s', msg)
+        return None
 
-    remaining_msg = msg.removeprefix(consts.SYSEX_HEADER)
+    # We already know the header matches, so read the bytes after it directly
+    # rather than slicing it off
+    origin = msg[HEADER_LEN]
+    client_id = msg[HEADER_LEN + 1]
+    msg_type = msg[HEADER_LEN + 2]
 
     # Handle loopback (prevent us from receiving our own messages)
-    if remaining_msg[0] != MessageOrigin.SERVER:
+    if origin != MessageOrigin.SERVER:
         return None
 
     # Handle other clients (prevent us from receiving their messages)
     # We still accept client ID zero, since it targets all devices
-    if remaining_msg[1] not in [0, get_context().client_id]:
+    if client_id and client_id != get_context().client_id:
         return None
 
-    # Handle FL Studio stdout
-    if remaining_msg[2] == MessageType.STDOUT:
-        text = b64decode(remaining_msg[3:]).decode()
-        log.debug(f"Received server stdout: {text}")
-        handle_stdout(text)
+    # Handle messages that aren't responses to our requests
+    handler = message_handlers.get(msg_type)
+    if handler is not None:
+        # Use a view of the data, rather than copying it
+        handler(memoryview(msg)[HEADER_LEN + 3:])
         return None
 
-    # Handle exit command
-    if remaining_msg[2] == MessageType.CLIENT_GOODBYE:
-        code = int(b64decode(remaining_msg[3:]).decode())
-        log.info(f"Received exit command with code {code}")
-        raise FlapiClientExit(code)
+    # Normal processing (remove bytes for header, origin and client ID)
+    return msg[HEADER_LEN + 2:]
 
-    # Handle server disconnect
-    if remaining_msg[2] == MessageType.SERVER_GOODBYE:
-        raise FlapiServerExit()
 
-    # Normal processing (remove bytes for header, origin and client ID)
-    return remaining_msg[2:]
+def decode_response_object(msg: bytes) -> Any:
+    """
+    Decode the Python object attached to a response (after its message type
+    and status)
+    """
+    try:
+        return decode_python_object(memoryview(msg)[2:])
+    except pickle.UnpicklingError as e:
+        # Types that aren't built-in can't be loaded safely, so report which
+        # type was sent instead
+        raise FlapiServerError(
+            f"FL Studio sent a value that couldn't be loaded: {e}"
+        ) from None
 
 
 def assert_response_is_ok(msg: bytes, expected_msg_type: MessageType):
@@ -97,60 +224,92 @@ def assert_response_is_ok(msg: bytes, expected_msg_type: MessageType):
     * MSG_STATUS_ERR: raise the exception
     * MSG_STATUS_FAIL: raise an exception describing the failure
     """
-    msg_type = MessageType(msg[0])
-
-    if msg_type != expected_msg_type:
+    if msg[0] != expected_msg_type:
         expected = expected_msg_type
-        actual = msg_type
+        # Only look up the type when reporting the error, and don't fail if
+        # it is unknown
+        try:
+            actual: Union[MessageType, int] = MessageType(msg[0])
+        except ValueError:
+            actual = msg[0]
         raise FlapiClientError(
             f"Expected message type '{expected}', received '{actual}'")
 
     msg_status = msg[1]
 
-    if msg_status == MessageStatus.OK:
+    if msg_status == STATUS_OK:
+        return
+    elif msg_status == STATUS_ERR:
+        raise decode_response_object(msg)
+    elif msg_status == STATUS_FAIL:
+        raise FlapiServerError(b64decode(memoryview(msg)[2:]).decode())
+
+
+def handle_midi_callback(msg: 'MidoMsg') -> None:
+    """
+    Callback for the response port, which is run on Mido's receiving thread
+    whenever a MIDI message arrives.
+
+    The message is pre-handled, and if it is a response to an event we sent,
+    it is added to the response queue. Messages that aren't from Flapi are
+    ignored. Exceptions raised during handling are also queued, so that they
+    are raised by `receive_message` on the thread waiting for the response.
+    """
+    # Flapi only uses sysex, so other messages (such as clock) are from other
+    # devices on the port
+    if msg.type != "sysex":
+        log.debug('Ignoring non-sysex message: %s', msg)
+        return
+    res_queue = get_context().res_queue
+    try:
+        # Sysex data already excludes the start and end bytes
+        response = handle_received_message(bytes(msg.data))
+    except (Exception, FlapiClientExit) as e:
+        res_queue.put(e)
         return
-    elif msg_status == MessageStatus.ERR:
-        raise decode_python_object(msg[2:])
-    elif msg_status == MessageStatus.FAIL:
-        raise FlapiServerError(b64decode(msg[2:]).decode())
+    if response is not None:
+        res_queue.put(response)
+
+
+def unpack_response(response: Union[bytes, BaseException]) -> bytes:
+    """
+    Unpack an item from the response queue, raising it if it is an exception
+    """
+    if isinstance(response, BaseException):
+        raise response
+    return response
 
 
 def poll_for_message() -> Optional[bytes]:
     """
-    Poll for new MIDI messages from FL Studio
+    Poll for new MIDI messages from FL Studio, returning `None` if no response
+    has been received.
     """
-    ctx = get_context()
-    if (msg := ctx.res_port.receive(block=False)) is not None:
-        # If there was a message, do pre-handling of message
-        # Make sure to remove the start and end bits to simplify processing
-        msg = handle_received_message(bytes(msg.bytes()[1:-1]))
-        # If it is None, this message wasn't a response message, try to get
-        # another one just in case there is one
-        if msg is None:
-            return poll_for_message()
-    return msg
+    try:
+        response = get_context().res_queue.get_nowait()
+    except Empty:
+        return None
+    return unpack_response(response)
 
 
 def receive_message() -> bytes:
     """
     Receive a MIDI message from FL Studio.
 
-    This busy waits until a message is received within the timeout window.
+    This blocks until a message is received within the timeout window.
 
     ## Raises
     * `TimeoutError`: a message was not received within the timeout window
     """
-    start_time = time.time()
-
-    while time.time() < start_time + consts.TIMEOUT_DURATION:
-        # Busy wait for a message
-        if (msg := poll_for_message()) is not None:
-            return msg
-
-    raise FlapiTimeoutError(
-        "Flapi didn't receive a message within the timeout window. Is FL "
-        "Studio running?"
-    )
+    try:
+        response = get_context().res_queue.get(
+            timeout=consts.TIMEOUT_DURATION)
+    except Empty:
+        raise FlapiTimeoutError(
+            "Flapi didn't receive a message within the timeout window. Is FL "
+            "Studio running?"
+        ) from None
+    return unpack_response(response)
 
 
 def hello() -> bool:
@@ -158,19 +317,14 @@ def hello() -> bool:
     Send a "client hello" message to FL Studio to attempt to establish a
     connection.
     """
-    client_id = get_context().client_id
-    log.debug(f"Attempt hello with {client_id=}")
-    assert client_id is not None
-    start = time.time()
+    ctx = get_context()
+    log.debug(f"Attempt hello with client_id={ctx.client_id}")
+    start = time.monotonic()
     try:
-        send_msg(consts.SYSEX_HEADER + bytes([
-            MessageOrigin.CLIENT,
-            client_id,
-            MessageType.CLIENT_HELLO,
-        ]))
+        send_msg(ctx.request_prefixes[MessageType.CLIENT_HELLO], ctx)
         response = receive_message()
         assert_response_is_ok(response, MessageType.CLIENT_HELLO)
-        end = time.time()
+        end = time.monotonic()
         log.debug(f"heartbeat: passed in {end - start:.3} seconds")
         return True
     except FlapiTimeoutError:
@@ -182,18 +336,12 @@ def client_goodbye(code: int) -> None:
     """
     Send a "client goodbye" message to FL Studio to close the connection.
     """
-    client_id = get_context().client_id
-    log.debug(f"Attempt hello with {client_id=}")
-    assert client_id is not None
-    send_msg(
-        consts.SYSEX_HEADER
-        + bytes([
-            MessageOrigin.CLIENT,
-            client_id,
-            MessageType.CLIENT_GOODBYE,
-        ])
-        + b64encode(str(code).encode())
-    )
+    ctx = get_context()
+    log.debug(f"Attempt goodbye with client_id={ctx.client_id}")
+    send_msg(b"".join((
+        ctx.request_prefixes[MessageType.CLIENT_GOODBYE],
+        b64encode(str(code).encode()),
+    )), ctx)
     try:
         res = receive_message()
         # We should never reach this point, as receiving the message should
@@ -206,17 +354,19 @@ def client_goodbye(code: int) -> None:
         return
 
 
-def version_query() -> tuple[int, int, int]:
+def send_version_query(ctx: FlapiContext) -> None:
     """
-    Query and return the version of Flapi installed to FL Studio.
+    Send a request for the version of Flapi installed to FL Studio, without
+    waiting for the response.
     """
-    client_id = get_context().client_id
-    assert client_id is not None
     log.debug("version_query")
-    send_msg(
-        consts.SYSEX_HEADER
-        + bytes([MessageOrigin.CLIENT, client_id, MessageType.VERSION_QUERY])
-    )
+    send_msg(ctx.request_prefixes[MessageType.VERSION_QUERY], ctx)
+
+
+def receive_version_query() -> tuple[int, int, int]:
+    """
+    Receive the response to a version query, returning the version.
+    """
     response = receive_message()
     log.debug("version_query: got response")
 
@@ -229,55 +379,108 @@ def version_query() -> tuple[int, int, int]:
     return (version[0], version[1], version[2])
 
 
-def fl_exec(code: str) -> None:
+def version_query() -> tuple[int, int, int]:
     """
-    Output Python code to FL Studio, where it will be executed.
+    Query and return the version of Flapi installed to FL Studio.
+    """
+    send_version_query(get_context())
+    return receive_version_query()
+
+
+def send_exec(code: str, ctx: FlapiContext) -> None:
+    """
+    Send Python code to FL Studio to be executed, without waiting for the
+    response.
+    """
+    log.debug("fl_exec: %s", code)
+    send_msg(b"".join((
+        ctx.request_prefixes[MessageType.EXEC],
+        encode_code(code),
+    )), ctx)
+
+
+def receive_exec() -> None:
+    """
+    Receive the response to executing code, raising any exception that the
+    code raised.
     """
-    client_id = get_context().client_id
-    assert client_id is not None
-    log.debug(f"fl_exec: {code}")
-    send_msg(
-        consts.SYSEX_HEADER
-        + bytes([MessageOrigin.CLIENT, client_id, MessageType.EXEC])
-        + b64encode(code.encode())
-    )
     response = receive_message()
     log.debug("fl_exec: got response")
 
     assert_response_is_ok(response, MessageType.EXEC)
 
 
+def fl_exec(code: str) -> None:
+    """
+    Output Python code to FL Studio, where it will be executed.
+    """
+    send_exec(code, get_context())
+    receive_exec()
+
+
 def fl_eval(expression: str) -> Any:
     """
     Output a Python expression to FL Studio, where it will be evaluated, with
     the result being returned.
     """
-    client_id = get_context().client_id
-    assert client_id is not None
-    log.debug(f"fl_eval: {expression}")
-    send_msg(
-        consts.SYSEX_HEADER
-        + bytes([MessageOrigin.CLIENT, client_id, MessageType.EVAL])
-        + b64encode(expression.encode())
-    )
+    ctx = get_context()
+    log.debug("fl_eval: %s", expression)
+    send_msg(b"".join((
+        ctx.request_prefixes[MessageType.EVAL],
+        encode_code(expression),
+    )), ctx)
     response = receive_message()
     log.debug("fl_eval: got response")
 
     assert_response_is_ok(response, MessageType.EVAL)
 
-    # Value is ok, eval and return it
-    return decode_python_object(response[2:])
+    # Value is ok, eval and return it (using a view of the data, so that it
+    # isn't copied before decoding)
+    return decode_response_object(response)
+
+
+def fl_batch(expressions: Sequence[str]) -> list[Any]:
+    """
+    Output a sequence of Python expressions to FL Studio, where they will be
+    evaluated in order, with the list of results being returned.
+
+    This only requires a single round-trip to FL Studio, so it is much faster
+    than calling `fl_eval` for each expression. If any expression raises an
+    exception, the remaining expressions are not evaluated, and the exception
+    is raised.
+    """
+    if not len(expressions):
+        return []
+    ctx = get_context()
+    log.debug("fl_batch: %s", expressions)
+    send_msg(b"".join((
+        ctx.request_prefixes[MessageType.EVAL_BATCH],
+        # Base-64 doesn't use commas, so they can separate the expressions
+        b",".join(encode_code(e) for e in expressions),
+    )), ctx)
+    response = receive_message()
+    log.debug("fl_batch: got response")
+
+    assert_response_is_ok(response, MessageType.EVAL_BATCH)
+
+    # Values are ok, return them
+    return decode_response_object(response)
 
 
 def fl_print(text: str):
     """
     Print the given text to FL Studio's Python console.
     """
-    client_id = get_context().client_id
-    assert client_id is not None
-    log.debug(f"fl_print (not expecting response): {text}")
-    send_msg(
-        consts.SYSEX_HEADER
-        + bytes([MessageOrigin.CLIENT, client_id, MessageType.STDOUT])
-        + b64encode(text.encode())
-    )
+    ctx = get_context()
+    log.debug("fl_print (not expecting response): %s", text)
+    if text.isascii():
+        # ASCII text is valid sysex data, so it doesn't need to be encoded
+        send_msg(b"".join((
+            ctx.request_prefixes[MessageType.STDOUT_RAW],
+            text.encode("ascii"),
+        )), ctx)
+    else:
+        send_msg(b"".join((
+            ctx.request_prefixes[MessageType.STDOUT],
+            b64encode(text.encode()),
+        )), ctx)
@@ -4,26 +4,50 @@
 Code for keeping track of the Flapi context, so that commands can be forwarded
 to the FL Studio API correctly.
 """
-from dataclasses import dataclass
-from mido.ports import BaseIOPort  # type: ignore
-from typing import Optional, TYPE_CHECKING
-from flapi.errors import FlapiContextError
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Callable, Optional, Union, TYPE_CHECKING
+from flapi.errors import FlapiContextError, FlapiConnectionError
 if TYPE_CHECKING:
+    from mido.ports import BaseIOPort  # type: ignore
     from flapi.__decorate import ApiCopyType
 
 
-@dataclass
+class RequestPrefixes(dict[int, bytes]):
+    """
+    The start of each type of request sent by a client (the sysex header,
+    message origin, client ID and message type), mapped from the message type.
+
+    This is empty when Flapi isn't connected to FL Studio, in which case
+    looking up a prefix raises an error. This means that request functions
+    don't need to check whether a client ID has been assigned.
+    """
+
+    def __missing__(self, key: int) -> bytes:
+        raise FlapiConnectionError(
+            "Flapi isn't connected to FL Studio - is it running? Once it is, "
+            "initialize Flapi again to connect to it."
+        )
+
+
+@dataclass(slots=True)
 class FlapiContext:
-    req_port: BaseIOPort
+    req_port: 'BaseIOPort'
     """
     The Mido port that Flapi uses to send requests to FL Studio
     """
 
-    res_port: BaseIOPort
+    res_port: 'BaseIOPort'
     """
     The Mido port that Flapi uses to receive responses from FL Studio
     """
 
+    send_raw: Callable[[bytes], None]
+    """
+    Function used to send a complete sysex frame (including the start and end
+    bytes) on the request port. See `make_raw_sender` in `__comms`.
+    """
+
     functions_backup: 'ApiCopyType'
     """
     References to all the functions we replaced in the FL Studio API, so that
@@ -35,6 +59,29 @@ class FlapiContext:
     Unique client ID for this instance of the Flapi client
     """
 
+    request_prefixes: RequestPrefixes = field(default_factory=RequestPrefixes)
+    """
+    The start of each type of request sent by this client. These are built when
+    the client ID is assigned, so that they don't need to be built for every
+    request.
+    """
+
+    batch_queue: Optional[list[str]] = None
+    """
+    Expressions for calls to wrapped API functions made within a
+    `flapi.batch()` block, which are evaluated together when the block exits.
+    This is `None` when calls aren't being batched.
+    """
+
+    res_queue: 'Queue[Union[bytes, BaseException]]' = field(
+        default_factory=Queue)
+    """
+    Queue of responses received from FL Studio. This is filled by the callback
+    on the response port, which runs on Mido's receiving thread. Exceptions
+    raised while handling a message are queued so that they can be raised on
+    the thread waiting for the response.
+    """
+
 
 context: Optional[FlapiContext] = None
 """
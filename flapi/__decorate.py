@@ -4,15 +4,17 @@
 Code for decorating the FL Studio API libraries to enable Flapi
 """
 import logging
-import inspect
 import importlib
+from contextlib import contextmanager
 from types import FunctionType
-from typing import Callable, TypeVar
+from typing import Any, Callable, Iterator, Optional, TypeVar
 from typing_extensions import ParamSpec
 from functools import wraps
-from .__comms import fl_eval
+from .__comms import fl_eval, fl_batch
+from .__context import get_context
 from ._consts import FL_MODULES
 from .__util import format_fn_params
+from .errors import FlapiBatchError
 
 P = ParamSpec('P')
 R = TypeVar('R')
@@ -21,6 +23,7 @@ log = logging.getLogger(__name__)
 
 
 ApiCopyType = dict[str, dict[str, FunctionType]]
+WrapperType = dict[str, dict[str, Callable]]
 
 
 def decorate(
@@ -32,37 +35,110 @@ def decorate(
     Create a decorator function that wraps the given function, returning the
     new function.
     """
+    # Build the constant parts of the call once, rather than on every call
+    call_prefix = f"{module}.{func_name}("
+    call_no_params = f"{call_prefix})"
+
     @wraps(func)
     def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-        params = format_fn_params(args, kwargs)
+        if not args and not kwargs:
+            expression = call_no_params
+        else:
+            params = format_fn_params(args, kwargs)
+            expression = call_prefix + params + ")"
+
+        # If we're batching calls, evaluate it when the batch ends instead
+        batch_queue = get_context().batch_queue
+        if batch_queue is not None:
+            batch_queue.append(expression)
+            return None  # type: ignore
 
-        return fl_eval(f"{module}.{func_name}({params})")
+        return fl_eval(expression)
 
     return wrapper
 
 
+@contextmanager
+def batch() -> Iterator[list[Any]]:
+    """
+    Batch calls to the FL Studio API, so that they are all evaluated in FL
+    Studio using a single round-trip when the block exits, rather than one
+    round-trip per call.
+
+    Within the block, calls to the API return `None`. Their return values are
+    added to the list given by the context manager once the block exits. If
+    the block raises an exception, the calls are discarded. Batches can't be
+    nested.
+
+    ```py
+    >>> with flapi.batch() as results:
+    ...     for i in range(10):
+    ...         mixer.setTrackVolume(i, 0.5)
+    ...     mixer.getTrackVolume(0)
+    >>> results[-1]
+    0.5
+    ```
+    """
+    ctx = get_context()
+    # Nested batches can't be flushed without reordering calls, which would
+    # change their effects in FL Studio
+    if ctx.batch_queue is not None:
+        raise FlapiBatchError()
+    batch_queue: list[str] = []
+    results: list[Any] = []
+    ctx.batch_queue = batch_queue
+    try:
+        yield results
+    finally:
+        ctx.batch_queue = None
+    results.extend(fl_batch(batch_queue))
+
+
+wrapper_cache: Optional[tuple[ApiCopyType, WrapperType]] = None
+"""
+The original FL Studio API functions, and the wrappers that replace them, so
+that the wrappers only need to be created the first time Flapi is enabled
+"""
+
+
 def add_wrappers() -> ApiCopyType:
     """
     For each FL Studio module, replace its items with a decorated version that
     evaluates the function inside FL Studio.
     """
+    global wrapper_cache
     log.info("Adding wrappers to API stubs")
 
-    modules: ApiCopyType = {}
-    for mod_name in FL_MODULES:
-        modules[mod_name] = {}
-
+    if wrapper_cache is None:
+        originals: ApiCopyType = {}
+        wrappers: WrapperType = {}
+        for mod_name in FL_MODULES:
+            originals[mod_name] = {}
+            wrappers[mod_name] = {}
+
+            mod = importlib.import_module(mod_name)
+            # For each function within the module
+            for func_name, func in vars(mod).items():
+                if not isinstance(func, FunctionType):
+                    continue
+                # Store the original into the dictionary
+                originals[mod_name][func_name] = func
+                # And decorate it
+                wrappers[mod_name][func_name] = \
+                    decorate(mod_name, func_name, func)
+        wrapper_cache = (originals, wrappers)
+
+    # Since the originals are cached, the functions can't be wrapped twice,
+    # even if Flapi is enabled again without being disabled
+    originals, wrappers = wrapper_cache
+    for mod_name, functions in wrappers.items():
         mod = importlib.import_module(mod_name)
-        # For each function within the module
-        for func_name, func in inspect.getmembers(mod, inspect.isfunction):
-            # Decorate it
-            decorated_func = decorate(mod_name, func_name, func)
-            # Store the original into the dictionary
-            modules[mod_name][func_name] = func
-            # Then replace it with our decorated version
+
+        for func_name, decorated_func in functions.items():
+            # Replace the function with our decorated version
             setattr(mod, func_name, decorated_func)
 
-    return modules
+    return originals
 
 
 def restore_original_functions(backup: ApiCopyType):
@@ -3,28 +3,46 @@
 
 Code for initializing/closing Flapi
 """
+import re
 import logging
 import random
-import mido  # type: ignore
-from typing import Protocol, Generic, TypeVar, Optional
-from mido.ports import BaseOutput, BaseInput  # type: ignore
+from functools import lru_cache
+from typing import Protocol, Generic, TypeVar, Optional, TYPE_CHECKING
 from . import _consts as consts
-from .__context import set_context, get_context, pop_context, FlapiContext
+from .__context import (
+    set_context,
+    get_context,
+    pop_context,
+    FlapiContext,
+    RequestPrefixes,
+)
 from .__comms import (
-    fl_exec,
     hello,
-    version_query,
+    send_version_query,
+    receive_version_query,
+    send_exec,
+    receive_exec,
     poll_for_message,
     client_goodbye,
+    handle_midi_callback,
+    make_raw_sender,
+    build_request_prefixes,
 )
 from .__decorate import restore_original_functions, add_wrappers
-from .errors import FlapiPortError, FlapiConnectionError, FlapiVersionError
+from .errors import (
+    FlapiPortError,
+    FlapiConnectionError,
+    FlapiContextError,
+    FlapiVersionError,
+)
+if TYPE_CHECKING:
+    from mido.ports import BaseOutput, BaseInput  # type: ignore
 
 
 log = logging.getLogger(__name__)
 
 
-T = TypeVar('T', BaseInput, BaseOutput, covariant=True)
+T = TypeVar('T', 'BaseInput', 'BaseOutput', covariant=True)
 
 
 class OpenPortFn(Protocol, Generic[T]):
@@ -34,6 +52,21 @@ class OpenPortFn(Protocol, Generic[T]):
         ...
 
 
+@lru_cache
+def port_name_pattern(port_name: str) -> re.Pattern[str]:
+    """
+    Build a pattern matching the names of ports to connect to for the given
+    port name
+    """
+    # Something appends numbers to each MIDI device to make them more unique
+    # or something, so the name must be accompanied by a number
+    name = re.escape(port_name)
+    return re.compile(
+        rf"\s*(?:\d+\s*{name}|{name}\s*\d+)\s*",
+        re.IGNORECASE,
+    )
+
+
 def open_port(
     port_name: str,
     port_names: list[str],
@@ -43,16 +76,11 @@ def open_port(
     Connect to a port which matches the given name, and if one cannot be found,
     attempt to create it
     """
+    pattern = port_name_pattern(port_name)
     for curr_port_name in port_names:  # type: ignore
-        # If the only thing after it is a number, we are free to connect to it
-        # It seems that something appends these numbers to each MIDI device to
-        # make them more unique or something
-        if port_name.lower() not in curr_port_name.lower():
-            continue
-        try:
-            # If this works, it's a match
-            int(curr_port_name.replace(port_name, '').strip())
-        except Exception:
+        # If the only thing other than the name is a number, we are free to
+        # connect to it
+        if pattern.fullmatch(curr_port_name) is None:
             continue
 
         # Connect to it
@@ -80,12 +108,25 @@ def enable(
       will need to call `init()` once FL Studio is running and configured
       correctly.
     """
+    # Mido (and its backend) is only imported when it is needed, so that
+    # importing Flapi is fast
+    import mido  # type: ignore
+
+    # If Flapi is already enabled, close its ports, since otherwise its
+    # response port would keep delivering messages to the new context
+    try:
+        old_ctx = pop_context()
+    except FlapiContextError:
+        pass
+    else:
+        log.info("Flapi was already enabled, closing its ports")
+        old_ctx.res_port.callback = None
+        old_ctx.req_port.close()
+        old_ctx.res_port.close()
+
     log.info(f"Enable Flapi client on ports '{req_port}', '{res_port}'")
     # First, connect to all the MIDI ports
     res_ports = mido.get_input_names()  # type: ignore
-    req_ports = mido.get_output_names()  # type: ignore
-
-    log.info(f"Available request ports are: {req_ports}")
     log.info(f"Available response ports are: {res_ports}")
 
     try:
@@ -93,13 +134,25 @@ def enable(
     except Exception:
         log.exception("Error when connecting to input")
         raise
-    try:
-        req = open_port(req_port, req_ports, mido.open_output)  # type: ignore
-    except Exception:
-        log.exception("Error when connecting to output")
-        raise
+
+    # Scanning for ports is slow on some backends, so only look for the
+    # request port if we'll be able to use it
+    req = None
+    if res is not None:
+        req_ports = mido.get_output_names()  # type: ignore
+        log.info(f"Available request ports are: {req_ports}")
+        try:
+            req = open_port(
+                req_port, req_ports, mido.open_output)  # type: ignore
+        except Exception:
+            log.exception("Error when connecting to output")
+            res.close()
+            raise
 
     if res is None or req is None:
+        # Close the port we did find, since we're replacing it
+        if res is not None:
+            res.close()
         try:
             req = mido.open_output(  # type: ignore
                 name=req_port,
@@ -118,7 +171,16 @@ def enable(
     functions_backup = add_wrappers()
 
     # Register the context
-    set_context(FlapiContext(req, res, functions_backup, None))
+    set_context(FlapiContext(
+        req_port=req,
+        res_port=res,
+        send_raw=make_raw_sender(req),
+        functions_backup=functions_backup,
+        client_id=None,
+    ))
+
+    # Handle responses as they arrive, rather than polling for them
+    res.callback = handle_midi_callback
 
     return try_init(random.randrange(1, 0x7F))
 
@@ -136,17 +198,22 @@ def try_init(client_id: int) -> bool:
     """
     Attempt to initialize Flapi, returning whether the operation was a success.
     """
-    assert get_context().client_id is None
-    get_context().client_id = client_id
-    # Poll for any new messages from FL Studio and handle them as required
-    poll_for_message()
+    ctx = get_context()
+    assert ctx.client_id is None
+    ctx.client_id = client_id
+    ctx.request_prefixes = build_request_prefixes(client_id)
+    # Discard any stale responses from FL Studio (eg from requests that timed
+    # out), so that they aren't mistaken for the response to our hello
+    while poll_for_message() is not None:
+        pass
     # Attempt to send a heartbeat message - if we get a response, we're already
     # connected
     if hello():
         setup_server()
         return True
     else:
-        get_context().client_id = None
+        ctx.client_id = None
+        ctx.request_prefixes = RequestPrefixes()
         return False
 
 
@@ -155,24 +222,35 @@ def setup_server():
     Perform the required setup on the server side, importing modules, and the
     like.
     """
+    ctx = get_context()
+    # Send all of the requests before waiting for any responses, so that the
+    # setup only takes a single round-trip. FL Studio handles requests in
+    # order, so the responses arrive in the same order.
+    send_version_query(ctx)
+    # Import all of the required modules in FL Studio
+    send_exec(f"import {', '.join(consts.FL_MODULES)}", ctx)
+
     # Make sure the versions are correct
-    version_check()
+    version_check(receive_version_query())
 
-    # Finally, import all of the required modules in FL Studio
-    fl_exec(f"import {', '.join(consts.FL_MODULES)}")
+    # Then make sure the imports succeeded
+    receive_exec()
 
     log.info("Server initialization succeeded")
 
 
-def version_check():
+def version_check(server_version: tuple[int, int, int]):
     """
     Ensure that the server version matches the client version.
 
     If not, raise an exception.
     """
-    server_version = version_query()
     client_version = consts.VERSION
 
+    # The versions almost always match, so check that first
+    if server_version == client_version:
+        return
+
     if server_version < client_version:
         raise FlapiVersionError(
             f"Server version {server_version} does not match client version "
@@ -186,7 +264,6 @@ def version_check():
             f"package manager. If you are using pip, run "
             f"`pip install --upgrade flapi`."
         )
-    # If we reach this point, the versions match
 
 
 def disable(code: int = 0):
@@ -203,10 +280,12 @@ def disable(code: int = 0):
     # Send a client goodbye
     client_goodbye(code)
 
-    # Close all the ports
-    ctx = pop_context()
+    # Close all the ports. This is done before clearing the context, since
+    # the response port's callback requires it.
+    ctx = get_context()
     ctx.req_port.close()
     ctx.res_port.close()
+    pop_context()
 
     # Then restore the functions
     restore_original_functions(ctx.functions_backup)
@@ -12,7 +12,8 @@ Remotely control FL Studio using the MIDI Controller Scripting API.
 ```
 """
 from .__enable import enable, init, try_init, disable
-from .__comms import hello, fl_exec, fl_eval, fl_print
+from .__comms import hello, fl_exec, fl_eval, fl_batch, fl_print
+from .__decorate import batch
 from . import errors
 from ._consts import VERSION
 
@@ -30,6 +31,8 @@ __all__ = [
     "hello",
     "fl_exec",
     "fl_eval",
+    "fl_batch",
     "fl_print",
+    "batch",
     "errors",
 ]
@@ -6,11 +6,11 @@ A simple program to run Flapi commands
 import click
 from click_default_group import DefaultGroup  # type: ignore
 from .cli import install, repl, uninstall
-from ._consts import VERSION
+from . import __version__
 
 
 @click.group(cls=DefaultGroup, default='repl', default_if_no_args=True)
-@click.version_option(".".join(str(n) for n in VERSION))
+@click.version_option(__version__)
 def cli():
     pass
 
@@ -3,31 +3,68 @@
 
 Helper functions
 """
+import builtins
 import pickle
-from base64 import b64decode
-from typing import Any
+from io import BytesIO
+try:
+    # Use the SIMD-accelerated implementation if it's available
+    from pybase64 import b64decode, b64encode  # type: ignore
+except ImportError:
+    from base64 import b64decode, b64encode
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Union
 
 
 def bytes_to_str(msg: bytes) -> str:
     """
     Helper to give a nicer representation of bytes
     """
-    return f"{repr([hex(i) for i in msg])} ({repr(msg)})"
+    return f"{msg.hex(' ')} ({repr(msg)})"
 
 
-def decode_python_object(data: bytes) -> Any:
+class RestrictedUnpickler(pickle.Unpickler):
     """
-    Encode Python object to send to the client
+    Unpickler that only loads built-in types, such as `int`, `list` and
+    exception classes.
+
+    Since anything on the MIDI port can send us a message, this prevents a
+    malicious message from running arbitrary code when it is unpickled.
+    """
+
+    def find_class(self, module: str, name: str) -> Any:
+        if module == "builtins" and not name.startswith("_"):
+            obj = getattr(builtins, name, None)
+            if isinstance(obj, type):
+                return obj
+        raise pickle.UnpicklingError(
+            f"Refusing to load '{module}.{name}' from data received from FL "
+            f"Studio, as only built-in types are allowed"
+        )
+
+
+def decode_python_object(data: Union[bytes, memoryview]) -> Any:
+    """
+    Decode Python object received from the server
+    """
+    return RestrictedUnpickler(BytesIO(b64decode(data))).load()
+
+
+@lru_cache(maxsize=256)
+def encode_code(code: str) -> bytes:
+    """
+    Encode code to send to FL Studio.
+
+    This is cached, since the same code is often sent repeatedly, for example
+    when polling a value using a wrapped API function.
     """
-    return pickle.loads(b64decode(data))
+    return b64encode(code.encode())
 
 
 def format_fn_params(args, kwargs):
-    args_str = ", ".join(repr(a) for a in args)
-    kwargs_str = ", ".join(f"{k}={repr(v)}" for k, v in kwargs.items())
-
-    # Overall parameters string (avoid invalid syntax by removing extra
-    # commas)
-    return f"{args_str}, {kwargs_str}"\
-        .removeprefix(", ")\
-        .removesuffix(", ")
+    # Join all the parameters at once, so that there are no extra commas to
+    # remove
+    return ", ".join(chain(
+        map(repr, args),
+        (f"{k}={repr(v)}" for k, v in kwargs.items()),
+    ))
@@ -17,3 +17,9 @@ CONNECTION_TIMEOUT = 60.0
 """
 The maximum duration to wait for a connection with FL Studio
 """
+
+
+CONNECTION_RETRY_DELAY_MAX = 0.5
+"""
+The maximum delay between attempts to connect to FL Studio
+"""
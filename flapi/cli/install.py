@@ -4,10 +4,10 @@
 Simple script for installing the Flapi server into FL Studio
 """
 import click
-from shutil import copytree, rmtree
+from shutil import copytree
 from pathlib import Path
 from . import consts
-from .util import yn_prompt, output_dir, server_dir
+from .util import yn_prompt, output_dir, server_dir, remove_server
 
 
 @click.command()
@@ -39,7 +39,7 @@ def install(data_dir: Path, yes: bool = False, dev: bool = False):
     # Determine scripts folder location
     output_location = output_dir(data_dir)
 
-    if output_location.exists():
+    if output_location.exists() or output_location.is_symlink():
         print(f"Warning: output directory '{output_location}' exists!")
         if yes:
             print("--yes used, continuing")
@@ -47,7 +47,7 @@ def install(data_dir: Path, yes: bool = False, dev: bool = False):
             if not yn_prompt("Overwrite? [y/N]: ", default=False):
                 print("Operation cancelled")
                 exit(1)
-        rmtree(output_location)
+        remove_server(output_location)
 
     # Determine where we are, so we can locate the script folder
     script_location = server_dir()
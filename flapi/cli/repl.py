@@ -10,6 +10,8 @@ import sys
 import os
 import time
 import random
+from functools import lru_cache
+from importlib.util import find_spec
 from typing import Optional
 from traceback import print_exc
 import flapi
@@ -20,20 +22,13 @@ from flapi import (
     disable,
     fl_exec,
     fl_eval,
+    fl_batch,
     fl_print,
 )
 from flapi import _consts as consts
 from flapi.errors import FlapiServerExit
 from flapi.cli import consts as cli_consts
 from .util import handle_verbose
-try:
-    import IPython
-    from IPython import start_ipython
-    from traitlets.config.loader import Config as IPythonConfig
-except ImportError:
-    IPython = None  # type: ignore
-    start_ipython = None  # type: ignore
-    IPythonConfig = None  # type: ignore
 
 
 SHELL_SCOPE = {
@@ -42,34 +37,30 @@ SHELL_SCOPE = {
     "disable": disable,
     "fl_exec": fl_exec,
     "fl_eval": fl_eval,
+    "fl_batch": fl_batch,
     "fl_print": fl_print,
 }
 
 
+ELLIPSIS_FRAMES = (".  ", ".. ", "...", " ..", "  .", "   ")
+"""
+Frames of the animated ellipsis shown while connecting to FL Studio
+"""
+
+
 def wait_for_connection(max_wait: float) -> bool:
     """
-    Busy wait until we establish a connection with FL Studio
+    Wait until we establish a connection with FL Studio
 
     Return whether wait was a success
     """
     def ellipsis(delta: float) -> str:
-        pos = int(delta * 2) % 6
-        if pos == 0:
-            return ".  "
-        elif pos == 1:
-            return ".. "
-        elif pos == 2:
-            return "..."
-        elif pos == 3:
-            return " .."
-        elif pos == 4:
-            return "  ."
-        else:  # pos == 5
-            return "   "
-
-    start_time = time.time()
+        return ELLIPSIS_FRAMES[int(delta * 2) % len(ELLIPSIS_FRAMES)]
+
+    start_time = time.monotonic()
+    retry_delay = 0.0
     while not try_init(random.randrange(1, 0x7F)):
-        delta = time.time() - start_time
+        delta = time.monotonic() - start_time
         if delta > max_wait:
             return False
 
@@ -80,42 +71,71 @@ def wait_for_connection(max_wait: float) -> bool:
             end='\r',
         )
 
+        # Back off between attempts so that FL Studio doesn't need to answer a
+        # hello request every TIMEOUT_DURATION while it starts. This delays
+        # the connection by at most CONNECTION_RETRY_DELAY_MAX.
+        time.sleep(retry_delay)
+        retry_delay = min(
+            2 * retry_delay + 0.05,
+            cli_consts.CONNECTION_RETRY_DELAY_MAX,
+        )
+
     # Yucky thing to ensure that we write all the way to the end of the line
     msg = "Connected to FL Studio"
     print(msg + ' ' * (os.get_terminal_size().columns - len(msg)))
     return True
 
 
-def exec_lines(lines: list[str]) -> bool:
+@lru_cache(maxsize=256)
+def classify_source(source: str) -> Optional[bool]:
+    """
+    Determine whether the given source code is a statement, returning `True`
+    for a statement, `False` for an expression, or `None` if the code is
+    incomplete.
+
+    Raises an exception if the code is complete but has some kind of error.
+
+    This is cached, since the same code is often entered repeatedly, for
+    example when checking a value.
+    """
+    # Determine if the code is an expression first, since that is the most
+    # common case, and a complete expression only needs to be compiled once
+    # https://stackoverflow.com/a/3876268/6335363
+    try:
+        compile(source, "<input>", "eval")
+        return False
+    except SyntaxError:
+        pass
+
+    # Check if the lines actually compile
+    if code.compile_command(source) is None:
+        return None
+    return True
+
+
+def exec_lines(source: str) -> bool:
     """
-    Attempt to execute the given lines on the server.
+    Attempt to execute the given source code on the server.
 
     Returns `True` if the lines were executed, or `False` if the code is
     incomplete.
 
     Raises an exception if the code is complete but has some kind of error.
     """
-    source = "\n".join(lines)
+    # Check for the exit command before compiling anything
+    if source == "exit":
+        disable()
+        exit()
 
-    # First check if the lines actually compile
     # This raises an error if the lines are complete, but invalid
     try:
-        if code.compile_command(source) is None:
-            return False
+        is_statement = classify_source(source)
     except Exception:
         print_exc()
         return True
+    if is_statement is None:
+        return False
 
-    # Determine if the code is a statement, an expression, or invalid
-    # https://stackoverflow.com/a/3876268/6335363
-    try:
-        code.compile_command(source, symbol='eval')
-        is_statement = False
-    except SyntaxError:
-        is_statement = True
-
-    if code == "exit":
-        exit()
     try:
         if is_statement:
             fl_exec(source)
@@ -138,13 +158,15 @@ def start_server_shell():
     """
     A simple REPL where all code is run server-side
     """
-    lines = []
+    # Source code entered so far, kept as a string so that it doesn't need to
+    # be joined every time a line is entered
+    source = ""
 
     last_was_interrupted = False
 
     while True:
         try:
-            line = input(">>> " if not len(lines) else "... ")
+            line = input("... " if source else ">>> ")
         except KeyboardInterrupt:
             if last_was_interrupted:
                 disable()
@@ -155,11 +177,11 @@ def start_server_shell():
                 continue
 
         last_was_interrupted = False
-        lines.append(line)
+        source = f"{source}\n{line}" if source else line
 
         # If we fully executed the lines, clear the buffer
-        if exec_lines(lines):
-            lines = []
+        if exec_lines(source):
+            source = ""
 
 
 def start_python_shell():
@@ -172,19 +194,41 @@ def start_python_shell():
     )
 
 
+def ipython_available() -> bool:
+    """
+    Returns whether IPython is installed, without importing it, since it is
+    slow to import
+    """
+    return find_spec("IPython") is not None
+
+
 def start_ipython_shell():
     """
     Start up an Ipython shell
     """
-    assert IPython is not None
-    assert start_ipython is not None
-    assert IPythonConfig is not None
+    # Only import IPython once we need it, since it is slow to import
+    import IPython
+    from IPython import start_ipython
+    from traitlets.config.loader import Config as IPythonConfig
+
     config = IPythonConfig()
     config.TerminalInteractiveShell.banner1 \
         = f"IPython version: {IPython.__version__}"
     start_ipython(argv=[], user_ns=SHELL_SCOPE, config=config)
 
 
+def print_connection_failure(next_step: str):
+    """
+    Print a message explaining that Flapi could not connect to FL Studio,
+    followed by the next step the user should take
+    """
+    print("\n".join([
+        "Flapi could not connect to FL Studio.",
+        "Please verify that FL Studio is running and the server is installed",
+        next_step,
+    ]))
+
+
 @click.command()
 @click.option(
     "-s",
@@ -222,9 +266,11 @@ def repl(
 ):
     """Main function to set up the Python shell"""
     handle_verbose(verbose)
-    print("Flapi interactive shell")
-    print(f"Client version: {flapi.__version__}")
-    print(f"Python version: {sys.version}")
+    print("\n".join([
+        "Flapi interactive shell",
+        f"Client version: {flapi.__version__}",
+        f"Python version: {sys.version}",
+    ]))
 
     # Set up the connection
     status = enable(req, res)
@@ -233,39 +279,28 @@ def repl(
         status = wait_for_connection(timeout)
 
     if shell == "server":
-        if status:
-            start_server_shell()
-        else:
-            print("Flapi could not connect to FL Studio.")
-            print(
-                "Please verify that FL Studio is running and the server is "
-                "installed"
-            )
-            print("Then, run this command again.")
+        if not status:
+            print_connection_failure("Then, run this command again.")
             exit(1)
+        return start_server_shell()
 
     if not status:
-        print("Flapi could not connect to FL Studio.")
-        print(
-            "Please verify that FL Studio is running and the server is "
-            "installed"
-        )
-        print("Then, run `init()` to create the connection.")
+        print_connection_failure(
+            "Then, run `init()` to create the connection.")
 
-    print("Imported functions:")
-    print(", ".join(SHELL_SCOPE.keys()))
+    print(f"Imported functions:\n{', '.join(SHELL_SCOPE.keys())}")
 
     if shell == "python":
         return start_python_shell()
     elif shell == "ipython":
-        if IPython is None:
+        if not ipython_available():
             print("Error: IPython is not installed!")
             exit(1)
         return start_ipython_shell()
     else:
         # Default: launch IPython if possible, but fall back to the default
         # shell
-        if IPython is not None:
+        if ipython_available():
             return start_ipython_shell()
         else:
             return start_python_shell()
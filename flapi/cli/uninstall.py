@@ -4,10 +4,9 @@
 Simple script for removing the Flapi server FL Studio
 """
 import click
-from shutil import rmtree
 from pathlib import Path
 from . import consts
-from .util import output_dir
+from .util import output_dir, remove_server
 
 
 @click.command()
@@ -32,5 +31,5 @@ def uninstall(data_dir: Path = consts.DEFAULT_IL_DATA_DIR):
     server_location = output_dir(data_dir)
 
     # Remove it
-    rmtree(server_location)
+    remove_server(server_location)
     print("Success!")
@@ -3,6 +3,10 @@
 
 Helper functions for CLI
 """
+import sys
+import click
+from functools import cache
+from shutil import rmtree
 from typing import Optional
 from pathlib import Path
 import logging
@@ -20,9 +24,21 @@ def handle_verbose(verbose: int):
 def yn_prompt(prompt: str, default: Optional[bool] = None) -> bool:
     """
     Yes/no prompt
+
+    In a terminal, this responds as soon as a key is pressed, rather than
+    waiting for enter to be pressed.
     """
     while True:
-        res = input(prompt)
+        if sys.stdin.isatty():
+            print(prompt, end='', flush=True)
+            res = click.getchar()
+            # Echo the response, but not control keys or escape sequences
+            # (such as arrow keys)
+            print(res if res.isprintable() else '')
+        else:
+            res = input(prompt)
+        # Accept either case, and treat enter as an empty response
+        res = res.strip().lower()
         if res == 'y':
             return True
         if res == 'n':
@@ -33,6 +49,7 @@ def yn_prompt(prompt: str, default: Optional[bool] = None) -> bool:
             print("Invalid response")
 
 
+@cache
 def output_dir(data_dir: Path) -> Path:
     """
     Return the path to the directory where the script should be installed
@@ -41,8 +58,21 @@ def output_dir(data_dir: Path) -> Path:
         "FL Studio", "Settings", "Hardware", "Flapi Server")
 
 
+@cache
 def server_dir() -> Path:
     """
     Return the current location of the Flapi server script
     """
     return Path(__file__).parent.parent.joinpath("server")
+
+
+def remove_server(server_location: Path):
+    """
+    Remove the server installation at the given location
+    """
+    # Development installations are a symlink to the server directory, which
+    # rmtree refuses to remove
+    if server_location.is_symlink():
+        server_location.unlink()
+    else:
+        rmtree(server_location)
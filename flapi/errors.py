@@ -44,6 +44,18 @@ class FlapiContextError(Exception):
         )
 
 
+class FlapiBatchError(Exception):
+    """
+    A `flapi.batch()` block was started within another one
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            "Calls to `flapi.batch()` can't be nested, since the calls in "
+            "each batch would be sent to FL Studio out of order."
+        )
+
+
 class FlapiVersionError(Exception):
     """
     The version of the Flapi server doesn't match that of the Flapi client
@@ -53,6 +65,10 @@ class FlapiVersionError(Exception):
 class FlapiInvalidMsgError(ValueError):
     """
     Flapi unexpectedly received a MIDI message that it could not process
+
+    Flapi no longer raises this, since messages from other devices on its
+    MIDI port are ignored. It is kept so that code which catches it still
+    works.
     """
 
     def __init__(self, msg: bytes) -> None:
@@ -5,7 +5,7 @@ Constants used by Flapi
 """
 from enum import IntEnum
 
-VERSION = (1, 0, 1)
+VERSION = (1, 1, 0)
 """
 The version of Flapi in the format (major, minor, revision)
 """
@@ -97,6 +97,19 @@ class MessageType(IntEnum):
     Message contains text to write into stdout.
     """
 
+    EVAL_BATCH = 0x07
+    """
+    Eval batch message - this is used to run a sequence of `eval` commands in
+    FL Studio, where the list of values that they produce is returned. This
+    allows many expressions to be evaluated in a single round-trip.
+    """
+
+    STDOUT_RAW = 0x08
+    """
+    Message contains ASCII text to write into stdout. Since ASCII text is
+    already valid sysex data, it is sent as-is rather than base-64 encoded.
+    """
+
 
 class MessageStatus(IntEnum):
     """
@@ -119,29 +119,53 @@ def fl_eval(res: FlapiResponse, data: bytes):
     return res.eval(MessageStatus.OK, result)
 
 
+def fl_eval_batch(res: FlapiResponse, data: bytes):
+    # Expressions are individually base-64 encoded, and separated by commas
+    expressions = [b64decode(e) for e in data.split(b",")]
+    results = []
+    try:
+        for expression in expressions:
+            results.append(
+                eval(expression, connected_clients[res.client_id]))
+    except Exception as e:
+        # Something went wrong, give the error
+        return res.eval_batch(MessageStatus.ERR, e)
+
+    # Operation was a success, give response
+    return res.eval_batch(MessageStatus.OK, results)
+
+
 def receive_stdout(res: FlapiResponse, data: bytes):
     text = b64decode(data).decode()
     capout.fl_print(text)
 
 
+def receive_stdout_raw(res: FlapiResponse, data: bytes):
+    # ASCII text is sent without encoding
+    text = data.decode("ascii")
+    capout.fl_print(text)
+
+
 message_handlers = {
     MessageType.CLIENT_HELLO: client_hello,
     MessageType.CLIENT_GOODBYE: client_goodbye,
     MessageType.VERSION_QUERY: version_query,
     MessageType.EXEC: fl_exec,
     MessageType.EVAL: fl_eval,
+    MessageType.STDOUT: receive_stdout,
+    MessageType.EVAL_BATCH: fl_eval_batch,
+    MessageType.STDOUT_RAW: receive_stdout_raw,
 }
 
 
 def OnSysEx(event: 'FlMidiMsg'):
-    header = event.sysex[1:len(consts.SYSEX_HEADER)+1]  # Sysex header
+    # Ignore events that aren't Flapi messages (header follows the 0xF0 byte)
+    if not event.sysex.startswith(consts.SYSEX_HEADER, 1):
+        return
+
     # Remaining sysex data
     sysex_data = event.sysex[len(consts.SYSEX_HEADER)+1:-1]
 
-    # Ignore events that aren't Flapi messages
-    if header != consts.SYSEX_HEADER:
-        return
-
     message_origin = sysex_data[0]
 
     client_id = sysex_data[1]
@@ -19,6 +19,25 @@ except ImportError:
     pass
 
 
+FORWARD_HEADER = bytes([0xF0]) + SYSEX_HEADER + bytes([MessageOrigin.SERVER])
+"""
+Start of messages forwarded to the client, up to and including the message
+origin
+"""
+
+
+SERVER_GOODBYE_MSG = (
+    FORWARD_HEADER
+    # Target all clients by giving 0x00 client ID
+    + bytes([0x00])
+    + bytes([MessageType.SERVER_GOODBYE])
+    + bytes([0xF7])
+)
+"""
+Server goodbye message, sent to all clients when the server shuts down
+"""
+
+
 def OnInit():
     print("\n".join([
         "Flapi response server",
@@ -34,16 +53,15 @@ def OnInit():
 
 
 def OnSysEx(event: 'FlMidiMsg'):
-    header = event.sysex[1:len(SYSEX_HEADER)+1]  # Sysex header
-    # print_msg("Header", header)
+    # Ignore events that don't target the respond script (header follows the
+    # 0xF0 byte)
+    if not event.sysex.startswith(SYSEX_HEADER, 1):
+        return
+
     # Remaining sysex data
     sysex_data = event.sysex[len(SYSEX_HEADER)+1:]
     # print_msg("Data", sysex_data)
 
-    # Ignore events that don't target the respond script
-    if header != SYSEX_HEADER:
-        return
-
     # Check message origin
     if sysex_data[0] != MessageOrigin.INTERNAL:
         return
@@ -59,24 +77,11 @@ def OnSysEx(event: 'FlMidiMsg'):
     #     )
     # )
 
-    device.midiOutSysex(
-        bytes([0xF0])
-        + SYSEX_HEADER
-        + bytes([MessageOrigin.SERVER])
-        + sysex_data[1:]
-    )
+    device.midiOutSysex(FORWARD_HEADER + sysex_data[1:])
 
 
 def OnDeInit():
     """
     Send server goodbye message
     """
-    device.midiOutSysex(
-        bytes([0xF0])
-        + SYSEX_HEADER
-        + bytes([MessageOrigin.SERVER])
-        # Target all clients by giving 0x00 client ID
-        + bytes([0x00])
-        + bytes([MessageType.SERVER_GOODBYE])
-        + bytes([0xF7])
-    )
+    device.midiOutSysex(SERVER_GOODBYE_MSG)
@@ -11,6 +11,14 @@ from base64 import b64encode, b64decode
 from consts import SYSEX_HEADER, MessageOrigin, MessageType, MessageStatus
 
 
+RESPONSE_HEADER = (
+    bytes([0xF0]) + SYSEX_HEADER + bytes([MessageOrigin.INTERNAL])
+)
+"""
+Start of all responses, up to and including the message origin
+"""
+
+
 def send_sysex(msg: bytes):
     """
     Helper for sending sysex, with some debugging print statements, since this
@@ -62,9 +70,7 @@ class FlapiResponse:
 
     def fail(self, type: MessageType, info: str) -> Self:
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
             + bytes([type])
             + bytes([MessageStatus.FAIL])
@@ -75,9 +81,7 @@ class FlapiResponse:
 
     def client_hello(self) -> Self:
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
             + bytes([MessageType.CLIENT_HELLO])
             + bytes([MessageStatus.OK])
@@ -87,9 +91,7 @@ class FlapiResponse:
 
     def client_goodbye(self, exit_code: int) -> Self:
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
             + bytes([MessageType.CLIENT_GOODBYE])
             + bytes([MessageStatus.OK])
@@ -102,9 +104,7 @@ class FlapiResponse:
 
     def version_query(self, version_info: tuple[int, int, int]) -> Self:
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
             + bytes([MessageType.VERSION_QUERY])
             + bytes([MessageStatus.OK])
@@ -145,9 +145,7 @@ class FlapiResponse:
             response_data = bytes()
 
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
             + bytes([MessageType.EXEC])
             + bytes([status])
@@ -187,9 +185,7 @@ class FlapiResponse:
         data: Exception | str | Any,
     ) -> Self:
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
             + bytes([MessageType.EVAL])
             + bytes([status])
@@ -198,15 +194,51 @@ class FlapiResponse:
         )
         return self
 
+    @overload
+    def eval_batch(
+        self,
+        status: Literal[MessageStatus.OK],
+        data: list[Any],
+    ) -> Self:
+        ...
+
+    @overload
+    def eval_batch(
+        self,
+        status: Literal[MessageStatus.ERR],
+        data: Exception,
+    ) -> Self:
+        ...
+
+    def eval_batch(
+        self,
+        status: MessageStatus,
+        data: Exception | list[Any],
+    ) -> Self:
+        self.__messages.append(
+            RESPONSE_HEADER
+            + bytes([self.client_id])
+            + bytes([MessageType.EVAL_BATCH])
+            + bytes([status])
+            + encode_python_object(data)
+            + bytes([0xF7])
+        )
+        return self
+
     def stdout(self, content: str) -> Self:
+        if content.isascii():
+            # ASCII text is valid sysex data, so it doesn't need to be encoded
+            msg_type = MessageType.STDOUT_RAW
+            data = content.encode("ascii")
+        else:
+            msg_type = MessageType.STDOUT
+            data = b64encode(content.encode())
         self.__messages.append(
-            bytes([0xF0])
-            + SYSEX_HEADER
-            + bytes([MessageOrigin.INTERNAL])
+            RESPONSE_HEADER
             + bytes([self.client_id])
-            + bytes([MessageType.STDOUT])
+            + bytes([msg_type])
             + bytes([MessageStatus.OK])
-            + b64encode(content.encode())
+            + data
             + bytes([0xF7])
         )
         return self